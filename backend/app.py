@@ -1,27 +1,449 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import os
-import subprocess
-import tempfile
 import json
+import logging
+import bisect
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from datetime import datetime
-import whisper
-import librosa
-import soundfile as sf
+import ctranslate2
+from faster_whisper import BatchedInferencePipeline, WhisperModel, decode_audio
+from faster_whisper.vad import VadOptions, get_speech_timestamps
 import numpy as np
-from database import CSVDatabase
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from database import SQLiteDatabase
+
+# Per-request detail is logged at DEBUG, so it is skipped (not even formatted) at the default INFO level
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Parse request bodies and serialize responses with orjson instead of the stdlib json module"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app, origins='*', allow_headers=['Content-Type', 'Authorization'], methods=['GET', 'POST', 'OPTIONS'])
 
-# Initialize CSV database
-db = CSVDatabase()
+# Initialize SQLite database (imports recordings.csv on first run)
+db = SQLiteDatabase()
+
+# Recording saves are queued and written in batches off the request path
+RECORDING_BATCH_SIZE = 100
+RECORDING_BATCH_WINDOW_SECONDS = 0.2
+recording_queue = queue.Queue()
+# Counts of saves queued and written so far; the queue is FIFO, so save N is on disk once N have been written
+recordings_queued = 0
+recordings_written = 0
+recordings_progress = threading.Condition()
+
+def recording_payload_error(data):
+    """Return why a recording can't be stored, or None if it looks valid"""
+    if not isinstance(data, dict):
+        return 'Recording must be a JSON object'
+    recording_id = data.get('id')
+    if isinstance(recording_id, bool) or not isinstance(recording_id, (str, int)) or recording_id == '':
+        return 'Recording id is required'
+    duration = data.get('duration', 0)
+    if isinstance(duration, bool) or not isinstance(duration, (int, float)):
+        return 'Recording duration must be a number'
+    for field in ('patientName', 'doctorName', 'date', 'transcription', 'status'):
+        if data.get(field) is not None and not isinstance(data[field], str):
+            return f'Recording {field} must be a string'
+    return None
+
+def queue_recording(data):
+    """Queue a recording for the background writer"""
+    global recordings_queued
+    with recordings_progress:
+        recordings_queued += 1
+        recording_queue.put(data)
+
+def wait_for_queued_recordings():
+    """Block until every save queued before this call has been written"""
+    with recordings_progress:
+        # Saves queued after this point don't hold up the read
+        target = recordings_queued
+        recordings_progress.wait_for(lambda: recordings_written >= target)
+
+def recording_writer():
+    """Collect queued recordings for a short window and write them to the database together"""
+    global recordings_written
+    while True:
+        pending = [recording_queue.get()]
+        deadline = time.monotonic() + RECORDING_BATCH_WINDOW_SECONDS
+        while len(pending) < RECORDING_BATCH_SIZE:
+            try:
+                pending.append(recording_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        
+        # A batch is one transaction, so if it fails retry each recording on its own and only lose the bad ones
+        if not db.save_recordings(pending):
+            for recording in pending:
+                if not db.save_recording(recording):
+                    logger.error("Failed to save queued recording %s", recording.get('id'))
+        
+        with recordings_progress:
+            recordings_written += len(pending)
+            recordings_progress.notify_all()
+
+threading.Thread(target=recording_writer, daemon=True).start()
+
+# Whisper models are loaded in the background so the server can bind immediately
+whisper_on_cuda = ctranslate2.get_cuda_device_count() > 0
+# GPUs run FP16 to halve activation bandwidth. CPUs default to int8 weights (quantized at load time);
+# set WHISPER_CPU_COMPUTE_TYPE=bfloat16 on CPUs with AMX (e.g. Sapphire Rapids) to use its BF16 tiles
+whisper_cpu_compute_type = os.getenv('WHISPER_CPU_COMPUTE_TYPE', 'int8')
+whisper_device = "cuda" if whisper_on_cuda else "cpu"
+whisper_compute_type = "float16" if whisper_on_cuda else whisper_cpu_compute_type
+# FlashAttention-2 fuses self-attention into one kernel. It's opt-in (WHISPER_FLASH_ATTENTION=1) because it needs
+# an Ampere or newer GPU (the same ones that support BF16) and a CTranslate2 build compiled with it
+whisper_flash_attention = (
+    whisper_on_cuda
+    and os.getenv('WHISPER_FLASH_ATTENTION') == '1'
+    and 'bfloat16' in ctranslate2.get_supported_compute_types('cuda')
+)
+# Batched pipelines by model name; on CPU, short recordings go to tiny (~4x faster than base)
+whisper_pipelines = {}
+WHISPER_READY = threading.Event()
+
+SAMPLE_RATE = 16000
+SHORT_AUDIO_SECONDS = 15
+# Consultations are in English; fixing the language skips a detection pass over every batch
+WHISPER_LANGUAGE = "en"
+WINDOW_SAMPLES = 30 * SAMPLE_RATE  # Whisper decodes fixed 30-second windows
+VAD_OPTIONS = VadOptions(max_speech_duration_s=30, min_silence_duration_ms=160)
+
+# Transcriptions that arrive within this window share one batched Whisper pass
+BATCH_WINDOW_SECONDS = 0.05
+MAX_BATCH_REQUESTS = 8
+transcription_queue = queue.Queue()
+
+def find_speech_clips(audio):
+    """Pack VAD speech regions into [start, end] sample ranges that each fit one Whisper window"""
+    clips = []
+    for speech in get_speech_timestamps(audio, VAD_OPTIONS):
+        if clips and speech['end'] - clips[-1][0] <= WINDOW_SAMPLES:
+            clips[-1][1] = speech['end']
+        else:
+            clips.append([speech['start'], speech['end']])
+    return clips
+
+def run_whisper_batch(pipeline, batch):
+    """Transcribe several (audio, clips) pairs in one batched pass, returning a result per audio"""
+    results = [{'text': '', 'segments': []} for _ in batch]
+    
+    # Lay the audios end to end and point Whisper at every request's speech clips
+    offsets = []
+    clip_timestamps = []
+    offset = 0
+    for audio, clips in batch:
+        offsets.append(offset / SAMPLE_RATE)
+        for start, end in clips:
+            clip_timestamps.append({
+                'start': (offset + start) / SAMPLE_RATE,
+                'end': (offset + end) / SAMPLE_RATE
+            })
+        offset += len(audio)
+    
+    if not clip_timestamps:
+        return results
+    
+    combined_audio = np.concatenate([audio for audio, _ in batch])
+    segments, info = pipeline.transcribe(
+        combined_audio, clip_timestamps=clip_timestamps, batch_size=16, beam_size=1, language=WHISPER_LANGUAGE
+    )
+    
+    # Segments are generated lazily; decoding happens while consuming them
+    for segment in segments:
+        # Map each segment back to its request by where its midpoint falls
+        index = bisect.bisect_right(offsets, (segment.start + segment.end) / 2) - 1
+        results[index]['text'] += segment.text
+        # Only timing and text go back to the client; tokens and logprobs would bloat the payload
+        results[index]['segments'].append({
+            'start': round(segment.start - offsets[index], 3),
+            'end': round(segment.end - offsets[index], 3),
+            'text': segment.text
+        })
+    
+    return results
+
+def transcription_worker():
+    """Collect queued transcriptions for a short window and run them through Whisper together"""
+    while True:
+        pending = [transcription_queue.get()]
+        deadline = time.monotonic() + BATCH_WINDOW_SECONDS
+        while len(pending) < MAX_BATCH_REQUESTS:
+            try:
+                pending.append(transcription_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        
+        # Requests routed to different models can't share a pass
+        groups = {}
+        for item in pending:
+            groups.setdefault(item[0], []).append(item)
+        
+        for pipeline, items in groups.items():
+            try:
+                results = run_whisper_batch(pipeline, [(audio, clips) for _, audio, clips, _ in items])
+            except Exception as e:
+                for _, _, _, future in items:
+                    future.set_exception(e)
+                continue
+            
+            for (_, _, _, future), result in zip(items, results):
+                future.set_result(result)
+
+def load_whisper_pipeline(name, device, compute_type, cpu_threads, flash_attention=False):
+    """Build a batched pipeline for a Whisper model and warm it up with a second of silence"""
+    # Splits audio on VAD speech boundaries and runs the chunks through the model in batches
+    pipeline = BatchedInferencePipeline(
+        model=WhisperModel(
+            name,
+            device=device,
+            compute_type=compute_type,
+            cpu_threads=cpu_threads,
+            flash_attention=flash_attention
+        )
+    )
+    # The first pass pays for allocator and kernel setup, so do it before a request waits on it
+    warmup_audio = np.zeros(SAMPLE_RATE, dtype=np.float32)
+    run_whisper_batch(pipeline, [(warmup_audio, [[0, len(warmup_audio)]])])
+    return pipeline
+
+def load_whisper_models():
+    """Load and warm up the Whisper models, then start the transcription worker"""
+    try:
+        logger.info("Loading Whisper model...")
+        # Load the Silero VAD model now rather than on the first request
+        find_speech_clips(np.zeros(SAMPLE_RATE, dtype=np.float32))
+        # Give CTranslate2 every core for its GEMMs
+        cpu_threads = os.cpu_count() or 0
+        try:
+            whisper_pipelines['base'] = load_whisper_pipeline(
+                "base", whisper_device, whisper_compute_type, cpu_threads, flash_attention=whisper_flash_attention
+            )
+        except Exception as e:
+            if not whisper_flash_attention:
+                raise
+            # Builds without FlashAttention only fail once the model runs, so fall back to standard attention
+            logger.warning("FlashAttention unavailable, loading Whisper without it: %s", e)
+            whisper_pipelines['base'] = load_whisper_pipeline("base", whisper_device, whisper_compute_type, cpu_threads)
+        # On GPU base is fast enough for everything
+        if not whisper_on_cuda:
+            whisper_pipelines['tiny'] = load_whisper_pipeline("tiny", "cpu", whisper_cpu_compute_type, cpu_threads)
+        
+        threading.Thread(target=transcription_worker, daemon=True).start()
+        logger.info("Whisper model loaded successfully on %s (%s)", whisper_device, whisper_compute_type)
+    except Exception as e:
+        whisper_pipelines.clear()
+        logger.exception("Failed to load Whisper model: %s", e)
+    finally:
+        WHISPER_READY.set()
+
+threading.Thread(target=load_whisper_models, daemon=True).start()
+
+def run_whisper(audio):
+    """Queue decoded audio for the batching worker and wait for its text and segments"""
+    # Requests that arrive during startup wait here for the models
+    WHISPER_READY.wait()
+    if not whisper_pipelines:
+        raise RuntimeError('Whisper model failed to load')
+    
+    pipeline = whisper_pipelines['base']
+    if 'tiny' in whisper_pipelines and len(audio) < SHORT_AUDIO_SECONDS * SAMPLE_RATE:
+        pipeline = whisper_pipelines['tiny']
+    
+    future = Future()
+    transcription_queue.put((pipeline, audio, find_speech_clips(audio), future))
+    return future.result()
+
+# Reuse keep-alive connections to Ollama across requests
+OLLAMA_URL = 'http://localhost:11434/api/generate'
+OLLAMA = requests.Session()
+OLLAMA.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Notes prompt template, built once; each request only concatenates its transcription between these
+NOTES_PROMPT_PREFIX = """Based on the medical consultation transcription below, generate BOTH clinical documentation and a patient summary.
+
+Transcription: """
+NOTES_PROMPT_SUFFIX = """
+
+Respond with ONLY a JSON object in this exact format (no explanatory text, no markdown, no code blocks):
+
+{
+  "doctorNotes": {
+    "subjective": "Patient's reported symptoms and concerns",
+    "objective": "Physical findings and observations",
+    "assessment": "Medical diagnosis or impression", 
+    "plan": "Treatment plan and follow-up instructions",
+    "medications": ["medication1", "medication2"],
+    "followUp": "Follow-up instructions"
+  },
+  "patientSummary": {
+    "summary": "Brief summary of what was discussed in simple terms",
+    "keyPoints": ["key point 1", "key point 2", "key point 3"],
+    "nextSteps": ["step 1", "step 2", "step 3"],
+    "medications": ["medication 1 in plain language", "medication 2 in plain language"]
+  }
+}"""
+
+# Upper bound on generated tokens; a complete notes object is a few hundred, so this only stops runaway output
+NOTES_MAX_TOKENS = 1024
+
+# Generated notes keyed by a hash of model + prompt, so retries and refreshes skip the LLM
+NOTES_CACHE_SIZE = 512
+notes_cache = OrderedDict()
+notes_cache_lock = threading.Lock()
+
+def notes_cache_key(model, prompt):
+    """Hash the model and full prompt; template changes invalidate old entries automatically"""
+    return hashlib.sha256(f"{model}\0{prompt}".encode('utf-8')).hexdigest()
+
+def get_cached_notes(key):
+    """Return cached notes for key (marking them recently used), or None"""
+    with notes_cache_lock:
+        notes = notes_cache.get(key)
+        if notes is not None:
+            notes_cache.move_to_end(key)
+        return notes
 
-# Load Whisper model once at startup
-print("Loading Whisper model...")
-whisper_model = whisper.load_model("base")
-# whisper_model = whisper.load_model("tiny")
-print("Whisper model loaded successfully")
+def cache_notes(key, notes):
+    """Store notes under key, evicting the least recently used entry when full"""
+    with notes_cache_lock:
+        notes_cache[key] = notes
+        notes_cache.move_to_end(key)
+        if len(notes_cache) > NOTES_CACHE_SIZE:
+            notes_cache.popitem(last=False)
+
+def ollama_payload(model, prompt, stream):
+    """Build the /api/generate request body for a notes prompt"""
+    return {
+        'model': model,
+        'prompt': prompt,
+        'stream': stream,
+        'format': 'json',  # Constrain decoding to valid JSON
+        'options': {'temperature': 0.2, 'num_ctx': 4096, 'num_predict': NOTES_MAX_TOKENS}
+    }
+
+# Reused for pulling the notes object out of responses with text around it
+JSON_DECODER = json.JSONDecoder()
+
+def clean_and_parse_response(response_text):
+    """Parse the JSON object from an LLM response, ignoring any text or markdown fences around it"""
+    # format=json responses are normally the bare object
+    try:
+        parsed_data = orjson.loads(response_text)
+    except json.JSONDecodeError:
+        pass
+    else:
+        # Valid JSON that isn't an object (a list, a string) can't hold the notes
+        if not isinstance(parsed_data, dict):
+            raise json.JSONDecodeError("Expected a JSON object", response_text, 0)
+        return parsed_data
+    
+    # raw_decode reads exactly one object starting at the first brace (in C) and ignores whatever follows
+    start_idx = response_text.find('{')
+    if start_idx == -1:
+        raise json.JSONDecodeError("No valid JSON found", response_text, 0)
+    
+    try:
+        parsed_data, _ = JSON_DECODER.raw_decode(response_text, start_idx)
+    except json.JSONDecodeError as e:
+        logger.warning("Parsing error: %s", e)
+        raise
+    return parsed_data
+
+def parse_notes(raw_response):
+    """Parse the LLM's combined JSON into the doctorNotes/patientSummary response body"""
+    logger.debug("Parsing combined response: %.100s...", raw_response)
+    
+    parsed_data = clean_and_parse_response(raw_response)
+    
+    logger.debug("✅ Successfully parsed combined JSON from LLM response")
+    
+    return {
+        'doctorNotes': parsed_data.get('doctorNotes', {}),
+        'patientSummary': parsed_data.get('patientSummary', {})
+    }
+
+def stream_ollama(model, prompt):
+    """Yield Ollama's response tokens, stopping as soon as the top-level JSON object closes"""
+    depth = 0
+    in_string = False
+    escaped = False
+    with OLLAMA.post(OLLAMA_URL, json=ollama_payload(model, prompt, stream=True), stream=True, timeout=300) as ollama_response:
+        if not ollama_response.ok:
+            raise RuntimeError('Failed to generate notes with Ollama')
+        
+        for line in ollama_response.iter_lines():
+            if not line:
+                continue
+            chunk = orjson.loads(line)
+            if 'error' in chunk:
+                raise RuntimeError(chunk['error'])
+            
+            token = chunk.get('response', '')
+            # Track brace depth outside of string literals as tokens arrive
+            for i, char in enumerate(token):
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif char == '\\':
+                        escaped = True
+                    elif char == '"':
+                        in_string = False
+                elif char == '"':
+                    in_string = True
+                elif char == '{':
+                    depth += 1
+                elif char == '}':
+                    depth -= 1
+                    if depth == 0:
+                        # Leaving the with block closes the connection, so Ollama stops generating
+                        yield token[:i + 1]
+                        return
+            
+            if token:
+                yield token
+            if chunk.get('done'):
+                return
+
+def stream_notes(model, prompt, cache_key):
+    """Forward Ollama's tokens as NDJSON lines, finishing with a line holding the parsed notes"""
+    chunks = []
+    try:
+        for token in stream_ollama(model, prompt):
+            chunks.append(token)
+            yield orjson.dumps({'response': token, 'done': False}) + b'\n'
+        
+        notes = parse_notes(''.join(chunks))
+    except json.JSONDecodeError as json_error:
+        logger.error("❌ Streaming notes parsing error: %s", json_error)
+        yield orjson.dumps({'done': True, 'error': 'Failed to parse notes generated by Ollama'}) + b'\n'
+        return
+    except Exception as e:
+        logger.error("❌ Streaming notes error: %s", e)
+        yield orjson.dumps({'done': True, 'error': str(e)}) + b'\n'
+        return
+    
+    cache_notes(cache_key, notes)
+    yield orjson.dumps({'done': True, **notes}) + b'\n'
 
 @app.route('/api/transcribe', methods=['POST'])
 def transcribe_audio():
@@ -32,96 +454,35 @@ def transcribe_audio():
         
         audio_file = request.files['audio']
         
-        # Determine file extension from filename or default to webm
-        if audio_file.filename and '.' in audio_file.filename:
-            file_extension = os.path.splitext(audio_file.filename)[1]
-        else:
-            file_extension = '.webm'  # Default for browser recordings
-            
-        print(f"Received audio file: {audio_file.filename}, extension: {file_extension}")
+        logger.debug("Received audio file: %s", audio_file.filename)
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_audio:
-            audio_file.save(temp_audio.name)
-            temp_file_path = temp_audio.name
-            
-        print(f"Saved audio to: {temp_file_path}")
+        # Werkzeug keeps the upload in memory (or its own spooled file), so
+        # decode straight from that stream instead of copying it to disk first
+        audio_stream = audio_file.stream
+        audio_stream.seek(0, os.SEEK_END)
+        file_size = audio_stream.tell()
+        audio_stream.seek(0)
+        logger.debug("Audio file size: %d bytes", file_size)
+        
+        if file_size == 0:
+            return jsonify({'error': 'Audio file is empty'}), 400
         
         try:
-            # Run Whisper transcription using Python library
-            print(f"Running Whisper on: {temp_file_path}")
-            
-            # Verify file exists before transcription
-            if not os.path.exists(temp_file_path):
-                raise FileNotFoundError(f"Audio file not found: {temp_file_path}")
-            
-            # Try direct Whisper transcription first (simpler approach)
+            # Decode webm/ogg/mp4/wav in-process straight to 16kHz mono float32
             try:
-                print("Direct Whisper transcription...")
-                
-                # Check file size and content
-                file_size = os.path.getsize(temp_file_path)
-                print(f"Audio file size: {file_size} bytes")
-                
-                if file_size == 0:
-                    raise ValueError("Audio file is empty")
-                
-                result = whisper_model.transcribe(temp_file_path)
-                
-            except Exception as whisper_error:
-                print(f"Direct Whisper error: {whisper_error}")
-                
-                # Use ffmpeg to convert to a format Whisper can definitely handle
-                try:
-                    print("Converting audio with ffmpeg...")
-                    
-                    # Create output path for converted file
-                    converted_wav_path = temp_file_path.replace(file_extension, '_converted.wav')
-                    
-                    # Use ffmpeg to convert to 16kHz mono WAV
-                    ffmpeg_cmd = [
-                        'ffmpeg', '-y',  # -y to overwrite output file
-                        '-i', temp_file_path,  # input file
-                        '-ar', '16000',  # sample rate 16kHz
-                        '-ac', '1',      # mono audio
-                        '-c:a', 'pcm_s16le',  # 16-bit PCM encoding
-                        converted_wav_path
-                    ]
-                    
-                    print(f"Running ffmpeg command: {' '.join(ffmpeg_cmd)}")
-                    result_ffmpeg = subprocess.run(ffmpeg_cmd, capture_output=True, text=True, check=True)
-                    
-                    print(f"ffmpeg conversion successful. Output: {converted_wav_path}")
-                    
-                    # Now try Whisper on the converted file
-                    if os.path.exists(converted_wav_path):
-                        converted_size = os.path.getsize(converted_wav_path)
-                        print(f"Converted file size: {converted_size} bytes")
-                        
-                        result = whisper_model.transcribe(converted_wav_path)
-                        
-                        # Clean up converted file
-                        os.unlink(converted_wav_path)
-                        print(f"Cleaned up converted file: {converted_wav_path}")
-                    else:
-                        raise FileNotFoundError("Converted file was not created")
-                        
-                except subprocess.CalledProcessError as ffmpeg_error:
-                    print(f"ffmpeg error: {ffmpeg_error}")
-                    print(f"ffmpeg stderr: {ffmpeg_error.stderr}")
-                    return jsonify({
-                        'error': f'Audio conversion failed. Please check that your audio recording is valid.'
-                    }), 500
-                    
-                except Exception as conversion_error:
-                    print(f"Conversion error: {conversion_error}")
-                    return jsonify({
-                        'error': f'Unable to process audio file. Please try recording again with a different format.'
-                    }), 500
+                audio_data = decode_audio(audio_stream)
+            except Exception as decode_error:
+                logger.warning("Audio decode error: %s", decode_error)
+                return jsonify({
+                    'error': f'Unable to process audio file. Please try recording again with a different format.'
+                }), 500
+            
+            result = run_whisper(audio_data)
             
             transcription_text = result["text"].strip()
             segments = result.get("segments", [])
             
-            print(f"Transcription successful: {transcription_text}...")
+            logger.debug("Transcription successful: %s...", transcription_text)
             
             return jsonify({
                 'transcription': transcription_text,
@@ -129,21 +490,11 @@ def transcribe_audio():
             })
             
         except Exception as whisper_error:
-            print(f"Whisper transcription error: {whisper_error}")
+            logger.error("Whisper transcription error: %s", whisper_error)
             return jsonify({'error': f'Transcription failed: {str(whisper_error)}'}), 500
-        finally:
-            # Cleanup - ensure file is deleted even if error occurs
-            if os.path.exists(temp_file_path):
-                try:
-                    os.unlink(temp_file_path)
-                    print(f"Cleaned up temp file: {temp_file_path}")
-                except OSError as e:
-                    print(f"Failed to cleanup temp file: {e}")
             
     except Exception as e:
-        print(f"Error in transcribe_audio: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in transcribe_audio: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/generate-notes', methods=['POST'])
@@ -152,146 +503,68 @@ def generate_notes():
     try:
         data = request.json
         transcription = data.get('transcription', '')
+        # Clients that ask for a stream get Ollama's tokens as NDJSON while they're generated
+        stream = bool(data.get('stream', False))
         
         if not transcription:
             return jsonify({'error': 'No transcription provided'}), 400
         
         # Prepare single prompt for Ollama to generate both doctor and patient notes
-        combined_prompt = f"""Based on the medical consultation transcription below, generate BOTH clinical documentation and a patient summary.
-
-Transcription: {transcription}
-
-Respond with ONLY a JSON object in this exact format (no explanatory text, no markdown, no code blocks):
-
-{{
-  "doctorNotes": {{
-    "subjective": "Patient's reported symptoms and concerns",
-    "objective": "Physical findings and observations",
-    "assessment": "Medical diagnosis or impression", 
-    "plan": "Treatment plan and follow-up instructions",
-    "medications": ["medication1", "medication2"],
-    "followUp": "Follow-up instructions"
-  }},
-  "patientSummary": {{
-    "summary": "Brief summary of what was discussed in simple terms",
-    "keyPoints": ["key point 1", "key point 2", "key point 3"],
-    "nextSteps": ["step 1", "step 2", "step 3"],
-    "medications": ["medication 1 in plain language", "medication 2 in plain language"]
-  }}
-}}"""
+        combined_prompt = NOTES_PROMPT_PREFIX + transcription + NOTES_PROMPT_SUFFIX
 
         model = 'llama3.1:8b'  # Use the more reliable model  
         
-        # Call Ollama for combined notes
-        result = subprocess.run([
-            'curl', '-X', 'POST', 'http://localhost:11434/api/generate',
-            '-H', 'Content-Type: application/json',
-            '-d', json.dumps({
-                'model': model,
-                'prompt': combined_prompt,
-                'stream': False
-            })
-        ], capture_output=True, text=True)
+        cache_key = notes_cache_key(model, combined_prompt)
+        cached_notes = get_cached_notes(cache_key)
+        if cached_notes is not None:
+            logger.debug("Returning cached notes for repeated transcription")
+            if stream:
+                return Response(orjson.dumps({'done': True, **cached_notes}) + b'\n', mimetype='application/x-ndjson')
+            return jsonify(cached_notes)
         
-        if result.returncode != 0:
-            return jsonify({'error': 'Failed to generate notes with Ollama'}), 500
+        if stream:
+            return Response(
+                stream_with_context(stream_notes(model, combined_prompt, cache_key)),
+                mimetype='application/x-ndjson'
+            )
         
-        # Parse Ollama response
-        print("Combined result stdout:", result.stdout[:500])  # First 500 chars
+        # Call Ollama for combined notes, reading only until the JSON object is complete
+        try:
+            raw_response = ''.join(stream_ollama(model, combined_prompt))
+        except (requests.RequestException, RuntimeError) as ollama_error:
+            logger.error("Ollama error: %s", ollama_error)
+            return jsonify({'error': 'Failed to generate notes with Ollama'}), 500
         
-        response = json.loads(result.stdout)
-        print("Raw response content:", response.get('response', '')[:300])
-        
-        # Clean and parse the response
-        def clean_and_parse_response(response_text):
-            """Clean markdown artifacts and parse JSON from LLM response"""
-            try:
-                # First, remove any lines that contain ```
-                lines = response_text.split('\n')
-                cleaned_lines = [line for line in lines if '```' not in line]
-                cleaned_text = '\n'.join(cleaned_lines)
-                
-                # Try direct JSON parsing on cleaned text
-                try:
-                    return json.loads(cleaned_text)
-                except json.JSONDecodeError:
-                    pass
-                
-                # Look for JSON within the cleaned text (find first { to last })
-                start_idx = cleaned_text.find('{')
-                if start_idx != -1:
-                    # Find the matching closing brace
-                    brace_count = 0
-                    end_idx = start_idx
-                    for i, char in enumerate(cleaned_text[start_idx:], start_idx):
-                        if char == '{':
-                            brace_count += 1
-                        elif char == '}':
-                            brace_count -= 1
-                            if brace_count == 0:
-                                end_idx = i + 1
-                                break
-                    
-                    json_str = cleaned_text[start_idx:end_idx]
-                    return json.loads(json_str)
-                
-                raise json.JSONDecodeError("No valid JSON found", response_text, 0)
-                
-            except Exception as e:
-                print(f"Parsing error: {e}")
-                raise
+        logger.debug("Raw response content: %.300s", raw_response)
         
         try:
-            raw_response = response['response']
-            print(f"Parsing combined response: {raw_response[:100]}...")
-            
-            parsed_data = clean_and_parse_response(raw_response)
-            
-            doctor_notes = parsed_data.get('doctorNotes', {})
-            patient_summary = parsed_data.get('patientSummary', {})
+            notes = parse_notes(raw_response)
+        except json.JSONDecodeError as json_error:
+            logger.error("❌ JSON parsing error: %s", json_error)
             
-            print("✅ Successfully parsed combined JSON from LLM response")
-            
-        except (json.JSONDecodeError, KeyError) as json_error:
-            print(f"❌ JSON parsing error: {json_error}")
-            print(f"Raw response: {response.get('response', 'No response')[:300]}")
-            
-            # Fallback if LLM doesn't return valid JSON
-            doctor_notes = {
-                'subjective': 'Patient reports symptoms as transcribed',
-                'objective': 'Physical examination findings noted',
-                'assessment': 'Clinical assessment pending review',
-                'plan': 'Treatment plan to be determined',
-                'medications': [],
-                'followUp': 'Follow-up as needed'
-            }
-            patient_summary = {
-                'summary': 'Please refer to your clinical notes for details',
-                'keyPoints': ['Consultation completed'],
-                'nextSteps': ['Follow up with your healthcare provider'],
-                'medications': []
-            }
+            return jsonify({'error': 'Failed to parse notes generated by Ollama'}), 500
         
-        return jsonify({
-            'doctorNotes': doctor_notes,
-            'patientSummary': patient_summary
-        })
+        cache_notes(cache_key, notes)
+        
+        return jsonify(notes)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/recordings', methods=['POST'])
 def save_recording():
-    """Save a recording to the CSV database"""
+    """Save a recording to the database"""
     try:
         data = request.json
-        success = db.save_recording(data)
+        # Saves are acknowledged before they're written, so reject bad input while the client can still see it
+        payload_error = recording_payload_error(data)
+        if payload_error:
+            return jsonify({'status': 'error', 'message': payload_error}), 400
+        
+        queue_recording(data)
+        
+        return jsonify({'status': 'queued', 'message': 'Recording queued for saving'}), 202
         
-        if success:
-            return jsonify({'status': 'success', 'message': 'Recording saved successfully'})
-        else:
-            return jsonify({'status': 'error', 'message': 'Failed to save recording'}), 500
-            
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -299,6 +572,8 @@ def save_recording():
 def get_recording(recording_id):
     """Get a specific recording by ID"""
     try:
+        # Wait for saves queued before this request so it sees them
+        wait_for_queued_recordings()
         recording = db.get_recording(recording_id)
         
         if recording:
@@ -313,6 +588,8 @@ def get_recording(recording_id):
 def get_all_recordings():
     """Get all recordings from the database"""
     try:
+        # Wait for saves queued before this request so it sees them
+        wait_for_queued_recordings()
         recordings = db.get_all_recordings()
         return jsonify({'status': 'success', 'recordings': recordings})
         
@@ -323,6 +600,8 @@ def get_all_recordings():
 def delete_recording(recording_id):
     """Delete a recording from the database"""
     try:
+        # Wait for saves queued before this request so it sees them
+        wait_for_queued_recordings()
         success = db.delete_recording(recording_id)
         
         if success:
@@ -336,7 +615,13 @@ def delete_recording(recording_id):
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    return jsonify({
+        'status': 'healthy',
+        'whisperReady': WHISPER_READY.is_set() and bool(whisper_pipelines),
+        'timestamp': datetime.now().isoformat()
+    })
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    # Development only; serve with gunicorn (see start-backend.sh) for concurrent requests.
+    # The reloader would start a second process and load the Whisper models twice, so it stays off
+    app.run(port=5000, debug=os.getenv('FLASK_DEBUG') == '1', use_reloader=False, threaded=True)
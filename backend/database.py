@@ -1,139 +1,138 @@
 import csv
+import logging
 import os
-import json
+import sqlite3
+import threading
+import orjson
 from datetime import datetime
 from typing import Dict, List, Optional
 
-class CSVDatabase:
-    def __init__(self, csv_file: str = 'recordings.csv'):
-        self.csv_file = csv_file
+logger = logging.getLogger(__name__)
+
+class SQLiteDatabase:
+    def __init__(self, db_file: str = 'recordings.db', legacy_csv_file: str = 'recordings.csv'):
+        self.db_file = db_file
         self.fieldnames = [
             'id', 'patient_name', 'doctor_name', 'date', 'duration',
             'transcription', 'doctor_notes', 'patient_summary', 'status'
         ]
-        self._ensure_csv_exists()
+        # One connection shared by the request threads and the save queue, used under a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._ensure_table_exists()
+        self._import_legacy_csv(legacy_csv_file)
+    
+    def _ensure_table_exists(self):
+        """Create the recordings table if it doesn't exist"""
+        with self._conn:
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS recordings (
+                    id TEXT PRIMARY KEY,
+                    patient_name TEXT,
+                    doctor_name TEXT,
+                    date TEXT,
+                    duration INTEGER,
+                    transcription TEXT,
+                    doctor_notes TEXT,
+                    patient_summary TEXT,
+                    status TEXT
+                )
+            ''')
+    
+    def _import_legacy_csv(self, csv_file: str):
+        """Copy recordings from the old CSV database, once per database file"""
+        # user_version marks the import as done, so deleting every recording doesn't bring the CSV rows back
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] >= 1:
+            return
+        
+        rows = []
+        # Databases that already hold recordings predate the marker and were imported then
+        if os.path.exists(csv_file) and not self._conn.execute('SELECT 1 FROM recordings LIMIT 1').fetchone():
+            with open(csv_file, 'r', newline='', encoding='utf-8') as file:
+                rows = list(csv.DictReader(file))
+        
+        # JSON columns are already encoded in the CSV, so rows go in as-is
+        with self._conn:
+            self._conn.executemany(self._upsert_sql(), rows)
+            self._conn.execute('PRAGMA user_version = 1')
+        if rows:
+            logger.info("Imported %d recording(s) from %s", len(rows), csv_file)
+    
+    def _upsert_sql(self) -> str:
+        """Upsert statement with a named parameter per field"""
+        columns = ', '.join(self.fieldnames)
+        placeholders = ', '.join(f':{name}' for name in self.fieldnames)
+        # Update in place rather than INSERT OR REPLACE, which deletes the row and moves it to the end of the list
+        updates = ', '.join(f'{name} = excluded.{name}' for name in self.fieldnames if name != 'id')
+        return f'INSERT INTO recordings ({columns}) VALUES ({placeholders}) ON CONFLICT(id) DO UPDATE SET {updates}'
+    
+    def _to_db_row(self, recording_data: Dict) -> Dict:
+        """Convert API recording data to a database row"""
+        return {
+            'id': recording_data.get('id'),
+            'patient_name': recording_data.get('patientName'),
+            'doctor_name': recording_data.get('doctorName'),
+            'date': recording_data.get('date', datetime.now().isoformat()),
+            'duration': recording_data.get('duration', 0),
+            'transcription': recording_data.get('transcription', ''),
+            'doctor_notes': orjson.dumps(recording_data.get('doctorNotes', {})).decode('utf-8'),
+            'patient_summary': orjson.dumps(recording_data.get('patientSummary', {})).decode('utf-8'),
+            'status': recording_data.get('status', 'completed')
+        }
     
-    def _ensure_csv_exists(self):
-        """Create CSV file with headers if it doesn't exist"""
-        if not os.path.exists(self.csv_file):
-            with open(self.csv_file, 'w', newline='', encoding='utf-8') as file:
-                writer = csv.DictWriter(file, fieldnames=self.fieldnames)
-                writer.writeheader()
+    def _from_db_row(self, row: sqlite3.Row) -> Dict:
+        """Convert a database row to a recording, parsing JSON fields back to objects"""
+        recording = dict(row)
+        recording['doctor_notes'] = orjson.loads(recording['doctor_notes']) if recording['doctor_notes'] else {}
+        recording['patient_summary'] = orjson.loads(recording['patient_summary']) if recording['patient_summary'] else {}
+        return recording
     
     def save_recording(self, recording_data: Dict) -> bool:
-        """Save a recording to the CSV database"""
-        try:
-            # Prepare data for CSV storage
-            csv_row = {
-                'id': recording_data.get('id'),
-                'patient_name': recording_data.get('patientName'),
-                'doctor_name': recording_data.get('doctorName'),
-                'date': recording_data.get('date', datetime.now().isoformat()),
-                'duration': recording_data.get('duration', 0),
-                'transcription': recording_data.get('transcription', ''),
-                'doctor_notes': json.dumps(recording_data.get('doctorNotes', {})),
-                'patient_summary': json.dumps(recording_data.get('patientSummary', {})),
-                'status': recording_data.get('status', 'completed')
-            }
-            
-            # Check if recording already exists (update instead of duplicate)
-            existing_recordings = self.get_all_recordings()
-            existing_ids = [r['id'] for r in existing_recordings]
-            
-            if csv_row['id'] in existing_ids:
-                # Update existing record
-                return self._update_recording(csv_row)
-            else:
-                # Add new record
-                with open(self.csv_file, 'a', newline='', encoding='utf-8') as file:
-                    writer = csv.DictWriter(file, fieldnames=self.fieldnames)
-                    writer.writerow(csv_row)
-                return True
-                
-        except Exception as e:
-            print(f"Error saving recording: {e}")
-            return False
+        """Save a recording to the database"""
+        return self.save_recordings([recording_data])
     
-    def _update_recording(self, updated_row: Dict) -> bool:
-        """Update an existing recording"""
+    def save_recordings(self, recordings_data: List[Dict]) -> bool:
+        """Save a batch of recordings in one transaction, updating any with the same ID in place"""
         try:
-            recordings = self.get_all_recordings()
-            
-            # Update the matching record
-            for i, recording in enumerate(recordings):
-                if recording['id'] == updated_row['id']:
-                    recordings[i] = updated_row
-                    break
-            
-            # Rewrite the entire CSV file
-            with open(self.csv_file, 'w', newline='', encoding='utf-8') as file:
-                writer = csv.DictWriter(file, fieldnames=self.fieldnames)
-                writer.writeheader()
-                writer.writerows(recordings)
-            
+            rows = [self._to_db_row(recording_data) for recording_data in recordings_data]
+            with self._lock, self._conn:
+                self._conn.executemany(self._upsert_sql(), rows)
             return True
         except Exception as e:
-            print(f"Error updating recording: {e}")
+            logger.error("Error saving recording: %s", e)
             return False
     
     def get_recording(self, recording_id: str) -> Optional[Dict]:
         """Get a specific recording by ID"""
         try:
-            with open(self.csv_file, 'r', newline='', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    if row['id'] == recording_id:
-                        # Parse JSON fields back to objects
-                        row['doctor_notes'] = json.loads(row['doctor_notes']) if row['doctor_notes'] else {}
-                        row['patient_summary'] = json.loads(row['patient_summary']) if row['patient_summary'] else {}
-                        return row
-            return None
+            with self._lock:
+                row = self._conn.execute(
+                    'SELECT * FROM recordings WHERE id = ?', (recording_id,)
+                ).fetchone()
+            return self._from_db_row(row) if row else None
         except Exception as e:
-            print(f"Error getting recording: {e}")
+            logger.error("Error getting recording: %s", e)
             return None
     
     def get_all_recordings(self) -> List[Dict]:
         """Get all recordings from the database"""
         try:
-            recordings = []
-            with open(self.csv_file, 'r', newline='', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    # Parse JSON fields back to objects
-                    row['doctor_notes'] = json.loads(row['doctor_notes']) if row['doctor_notes'] else {}
-                    row['patient_summary'] = json.loads(row['patient_summary']) if row['patient_summary'] else {}
-                    recordings.append(row)
-            return recordings
+            with self._lock:
+                rows = self._conn.execute('SELECT * FROM recordings ORDER BY rowid').fetchall()
+            return [self._from_db_row(row) for row in rows]
         except Exception as e:
-            print(f"Error getting all recordings: {e}")
+            logger.error("Error getting all recordings: %s", e)
             return []
     
     def delete_recording(self, recording_id: str) -> bool:
         """Delete a recording from the database"""
         try:
-            recordings = self.get_all_recordings()
-            recordings = [r for r in recordings if r['id'] != recording_id]
-            
-            # Rewrite the CSV file without the deleted record
-            with open(self.csv_file, 'w', newline='', encoding='utf-8') as file:
-                writer = csv.DictWriter(file, fieldnames=self.fieldnames)
-                writer.writeheader()
-                for recording in recordings:
-                    # Convert back to CSV format
-                    csv_row = {
-                        'id': recording['id'],
-                        'patient_name': recording['patient_name'],
-                        'doctor_name': recording['doctor_name'],
-                        'date': recording['date'],
-                        'duration': recording['duration'],
-                        'transcription': recording['transcription'],
-                        'doctor_notes': json.dumps(recording['doctor_notes']),
-                        'patient_summary': json.dumps(recording['patient_summary']),
-                        'status': recording['status']
-                    }
-                    writer.writerow(csv_row)
-            
+            with self._lock, self._conn:
+                self._conn.execute('DELETE FROM recordings WHERE id = ?', (recording_id,))
             return True
         except Exception as e:
-            print(f"Error deleting recording: {e}")
+            logger.error("Error deleting recording: %s", e)
             return False
@@ -20,6 +20,7 @@ const RecordingSession: React.FC = () => {
   });
 
   const [processing, setProcessing] = useState(false);
+  const [notesProgress, setNotesProgress] = useState(0);
   const [backendStatus, setBackendStatus] = useState<'checking' | 'online' | 'offline'>('checking');
 
   useEffect(() => {
@@ -118,6 +119,7 @@ const RecordingSession: React.FC = () => {
     if (!recorderState.audioBlob || !sessionId) return;
 
     setProcessing(true);
+    setNotesProgress(0);
 
     try {
       // Get consent data
@@ -142,7 +144,9 @@ const RecordingSession: React.FC = () => {
         console.log('Transcription:', transcription);
         
         console.log('Generating clinical notes...');
-        const notesResponse = await apiService.generateNotes(transcription);
+        const notesResponse = await apiService.generateNotesStream(transcription, (text) => {
+          setNotesProgress(prev => prev + text.length);
+        });
         console.log('Doctor Notes:', notesResponse.doctorNotes);
         console.log('Patient Summary:', notesResponse.patientSummary);
         doctorNotes = notesResponse.doctorNotes;
@@ -411,6 +415,7 @@ Plan:
                       ? 'Step 1: Transcribing with Whisper → Step 2: Generating notes with Ollama'
                       : 'Using demo transcription and AI-generated notes for demonstration'
                     }
+                    {notesProgress > 0 && ` (${notesProgress} characters generated)`}
                   </span>
                 </div>
               </div>
@@ -61,7 +61,54 @@ class ApiService {
     return response.data;
   }
 
-  async healthCheck(): Promise<{ status: string; timestamp: string }> {
+  async generateNotesStream(
+    transcription: string,
+    onToken?: (text: string) => void
+  ): Promise<NotesResponse> {
+    // axios can't read a response body incrementally in the browser, so stream with fetch
+    const response = await fetch(`${API_BASE_URL}/generate-notes`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ transcription, stream: true }),
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error(`Failed to generate notes: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split('\n');
+      buffer = lines.pop() ?? '';
+
+      for (const line of lines) {
+        if (!line.trim()) continue;
+
+        const chunk = JSON.parse(line);
+        if (chunk.done) {
+          if (chunk.error) throw new Error(chunk.error);
+          return {
+            doctorNotes: chunk.doctorNotes,
+            patientSummary: chunk.patientSummary,
+          };
+        }
+        onToken?.(chunk.response);
+      }
+    }
+
+    throw new Error('Notes stream ended before the notes were complete');
+  }
+
+  async healthCheck(): Promise<{ status: string; whisperReady: boolean; timestamp: string }> {
     console.log('Performing health check on url: ', API_BASE_URL + "/health");
     const response = await this.api.get('/health');
     return response.data;
@@ -50,6 +50,7 @@ npm run dev
 
 cd backend
 
-# Start Flask app
+# Start Flask app under gunicorn so transcription and note generation don't block each other.
+# A single worker keeps one copy of the Whisper models and lets concurrent transcriptions share batches.
 echo "🚀 Starting Flask server on http://localhost:5000"
-python app.py
+gunicorn -k gthread -w 1 --threads 8 --timeout 300 -b 127.0.0.1:5000 app:app